@@ -0,0 +1,237 @@
+import argparse
+import contextlib
+import copy
+import importlib
+import io
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import yaml
+
+# Banc de performance des variantes d'ApacheConfigGenerator. Des remplaçants
+# d'apache2ctl, a2enmod, a2dismod, systemctl et sudo sont placés en tête du PATH et
+# journalisent chaque appel ; tous les chemins de configuration pointent vers un
+# répertoire temporaire, aucun Apache réel ni droit root n'est nécessaire.
+
+VARIANTS = ['apache', 'apache_generate', 'generate', 'lol']
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+FAKE_COMMAND = """#!/bin/sh
+echo "$(basename "$0") $*" >> "$BENCH_COMMAND_LOG"
+case "$(basename "$0") $*" in
+    "apache2ctl -V")
+        echo "Server version: Apache/2.4.58 (Debian)"
+        echo "Server MPM:     event"
+        ;;
+    "apache2ctl -t -D DUMP_MODULES")
+        echo "Loaded Modules:"
+        echo " core_module (static)"
+        echo " mpm_event_module (shared)"
+        echo " deflate_module (shared)"
+        echo " headers_module (shared)"
+        echo " reqtimeout_module (shared)"
+        ;;
+esac
+exit 0
+"""
+
+FAKE_SUDO = """#!/bin/sh
+echo "sudo $*" >> "$BENCH_COMMAND_LOG"
+exec "$@"
+"""
+
+RELOAD_COMMANDS = {
+    ('systemctl', 'restart'), ('systemctl', 'reload'),
+    ('apache2ctl', 'graceful'), ('apache2ctl', 'restart'),
+}
+
+
+class GeneratorBenchmark:
+    def __init__(self, template_path='template.yaml', repeat=5):
+        self.template_path = template_path
+        self.repeat = repeat
+        with open(template_path, 'r') as file:
+            self.template = yaml.safe_load(file)
+        self.work_directory = os.path.realpath(tempfile.mkdtemp(prefix='apache-bench-'))
+        self.install_fake_commands()
+        self.install_mounts_fixture()
+
+    def install_fake_commands(self):
+        bin_directory = os.path.join(self.work_directory, 'bin')
+        os.makedirs(bin_directory)
+        for command, script in [('apache2ctl', FAKE_COMMAND), ('a2enmod', FAKE_COMMAND),
+                                ('a2dismod', FAKE_COMMAND), ('systemctl', FAKE_COMMAND), ('sudo', FAKE_SUDO)]:
+            command_path = os.path.join(bin_directory, command)
+            with open(command_path, 'w') as file:
+                file.write(script)
+            os.chmod(command_path, 0o755)
+        os.environ['PATH'] = bin_directory + os.pathsep + os.environ['PATH']
+        self.command_log = os.path.join(self.work_directory, 'commands.log')
+        os.environ['BENCH_COMMAND_LOG'] = self.command_log
+
+    def install_mounts_fixture(self):
+        # Table de montage figée : le résultat ne dépend pas des systèmes de fichiers de l'hôte.
+        # Les DocumentRoot vivent sous www/ (ext4), un site sur dix sous un montage NFS.
+        self.www_directory = os.path.join(self.work_directory, 'www')
+        self.mounts_file = os.path.join(self.work_directory, 'mounts')
+        lines = ["/dev/sda1 / ext4 rw,relatime 0 0", f"/dev/sdb1 {self.www_directory} ext4 rw,relatime 0 0"]
+        for index in range(0, 500, 10):
+            lines.append(f"nas:/export/site{index:04d} {self.document_root(index)} nfs4 rw,relatime 0 0")
+        with open(self.mounts_file, 'w') as file:
+            file.write("\n".join(lines) + "\n")
+        for index in range(500):
+            os.makedirs(self.document_root(index))
+
+    def document_root(self, index):
+        return os.path.join(self.www_directory, f'site{index:04d}', 'public')
+
+    def cases(self):
+        # Entrées de référence : le template tel quel, une grosse flotte de modules
+        # répartie dans des fichiers d'inventaire, et un grand nombre de DocumentRoot.
+        small = copy.deepcopy(self.template)
+        small['Static']['DocumentRoots'] = [self.document_root(0), self.document_root(1)]
+
+        large_fleet = copy.deepcopy(small)
+        inventory_directory = os.path.join(self.work_directory, 'inventory')
+        os.makedirs(inventory_directory, exist_ok=True)
+        for index in range(20):
+            inventory = {
+                'Modules': {f'mod_fleet{index:02d}_{module}': module % 2 == 0 for module in range(3)},
+                'Required_Modules': [f'fleet{index:02d}_{module}' for module in range(2)],
+            }
+            with open(os.path.join(inventory_directory, f'host{index:02d}.yaml'), 'w') as file:
+                yaml.safe_dump(inventory, file)
+        large_fleet['Includes'] = ['inventory/*.yaml']
+        large_fleet['Modules'].update({f'mod_extra{index:02d}': True for index in range(40)})
+
+        many_vhost = copy.deepcopy(self.template)
+        many_vhost['Static']['DocumentRoots'] = [self.document_root(index) for index in range(500)]
+
+        return {'small': small, 'large_fleet': large_fleet, 'many_vhost': many_vhost}
+
+    def run_once(self, variant, yaml_path, run_directory):
+        config_directory = os.path.join(run_directory, 'conf-available')
+        os.makedirs(config_directory)
+        apache2_conf_path = os.path.join(run_directory, 'apache2.conf')
+        with open(apache2_conf_path, 'w') as file:
+            file.write('# apache2.conf\n')
+        open(self.command_log, 'w').close()
+
+        module = importlib.import_module(variant)
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if variant == 'apache':
+                # La variante historique n'accepte que le YAML et fixe son répertoire en dur
+                generator = module.ApacheConfigGenerator(yaml_path)
+                generator.config_directory = config_directory
+            else:
+                generator = module.ApacheConfigGenerator(yaml_path, config_directory)
+                generator.apache2_conf_path = apache2_conf_path
+                generator.mounts_file = self.mounts_file
+            generator.generate_apache_config()
+        elapsed = time.perf_counter() - started
+
+        with open(self.command_log, 'r') as file:
+            commands = [line.split() for line in file if line.strip()]
+        # Chaque appel via sudo apparaît deux fois dans le journal : on ne compte que la commande réelle
+        commands = [command for command in commands if command[0] != 'sudo']
+        bytes_written = self.count_bytes(apache2_conf_path) - len('# apache2.conf\n')
+        for file_name in os.listdir(config_directory):
+            bytes_written += self.count_bytes(os.path.join(config_directory, file_name))
+
+        return {
+            'seconds': elapsed,
+            'subprocesses': len(commands),
+            'reloads': sum(1 for command in commands if tuple(command[:2]) in RELOAD_COMMANDS),
+            'bytes_written': bytes_written,
+        }
+
+    def count_bytes(self, file_path):
+        # Les chemins temporaires (Include, DocumentRoot) sont ramenés à un marqueur fixe
+        # pour que la mesure ne dépende pas de la longueur de TMPDIR.
+        with open(file_path, 'r') as file:
+            content = file.read()
+        return len(content.replace(self.work_directory, '$BENCH').encode())
+
+    def run(self, variants=VARIANTS):
+        results = {}
+        for case, config_data in self.cases().items():
+            yaml_path = os.path.join(self.work_directory, f'{case}.yaml')
+            with open(yaml_path, 'w') as file:
+                yaml.safe_dump(config_data, file, sort_keys=False)
+            for variant in variants:
+                runs = []
+                for index in range(self.repeat):
+                    run_directory = os.path.join(self.work_directory, 'runs', f'{variant}-{case}-{index}')
+                    runs.append(self.run_once(variant, yaml_path, run_directory))
+                result = dict(runs[-1])
+                result['seconds'] = statistics.median(run['seconds'] for run in runs)
+                results.setdefault(variant, {})[case] = result
+        return results
+
+    def cleanup(self):
+        shutil.rmtree(self.work_directory, ignore_errors=True)
+
+
+def compare(results, baseline, time_tolerance=1.5, time_slack=0.05, bytes_tolerance=1.1):
+    # Les compteurs sont déterministes et ne doivent pas augmenter ; le temps, qui dépend
+    # de la machine, a droit à un facteur de tolérance plus une marge absolue.
+    regressions = []
+    for variant, cases in results.items():
+        for case, result in cases.items():
+            reference = baseline.get(variant, {}).get(case)
+            if reference is None:
+                continue
+            name = f"{variant}/{case}"
+            for counter in ['subprocesses', 'reloads']:
+                if result[counter] > reference[counter]:
+                    regressions.append(f"{name}: {counter} {reference[counter]} -> {result[counter]}")
+            if result['bytes_written'] > reference['bytes_written'] * bytes_tolerance:
+                regressions.append(f"{name}: bytes_written {reference['bytes_written']} -> {result['bytes_written']}")
+            if result['seconds'] > reference['seconds'] * time_tolerance + time_slack:
+                regressions.append(f"{name}: seconds {reference['seconds']:.3f} -> {result['seconds']:.3f}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Banc de performance et de non-régression des générateurs")
+    parser.add_argument('--template', default='template.yaml')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--variant', action='append', choices=VARIANTS, help="par défaut, toutes")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update', action='store_true', help="enregistrer les résultats comme nouvelle référence")
+    args = parser.parse_args()
+
+    benchmark = GeneratorBenchmark(args.template, args.repeat)
+    try:
+        results = benchmark.run(args.variant or VARIANTS)
+    finally:
+        benchmark.cleanup()
+
+    print(f"{'variante':<16}{'entrée':<13}{'temps':>10}{'processus':>11}{'reloads':>9}{'octets':>10}")
+    for variant, cases in results.items():
+        for case, result in cases.items():
+            print(f"{variant:<16}{case:<13}{result['seconds'] * 1000:>8.1f}ms"
+                  f"{result['subprocesses']:>11}{result['reloads']:>9}{result['bytes_written']:>10}")
+
+    if args.update:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+            file.write('\n')
+        print(f"Référence enregistrée dans {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as file:
+            regressions = compare(results, json.load(file))
+        if regressions:
+            print("Régressions de performance :")
+            for regression in regressions:
+                print(f"  {regression}")
+            raise SystemExit(1)
+        print("Aucune régression par rapport à la référence.")
+    else:
+        print(f"Pas de référence ({args.baseline}), lancer avec --update pour l'enregistrer.")
@@ -0,0 +1,243 @@
+import argparse
+import math
+import re
+from datetime import datetime
+
+import numpy as np
+import yaml
+
+
+class CapacitySimulator:
+    # Simule hors ligne le pool de workers Apache comme une file M/G/c : chaque point de la
+    # grille (MaxRequestWorkers, ThreadsPerChild, KeepAliveTimeout) est évalué en une passe NumPy.
+
+    LOG_TIMESTAMP = re.compile(r'\[(\d{2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4})\]')
+
+    def __init__(self, yaml_file_path='template.yaml', mem_process=30.0, mem_thread=2.0,
+                 mem_connection=0.1, requests_per_session=10, think_time=1.0, connection_setup=0.002):
+        self.yaml_file_path = yaml_file_path
+        self.config_data = self.read_config() or {}
+        self.mpm_module = self.config_data.get('Modules', {}).get('mpm', 'event')
+        # Empreintes mémoire en Mo : processus enfant, thread worker, connexion keep-alive inactive
+        self.mem_process = mem_process
+        self.mem_thread = mem_thread
+        self.mem_connection = mem_connection
+        # Clients : requêtes par visite, pause moyenne (s) entre deux requêtes d'une visite,
+        # et coût serveur (s) d'ouverture d'une connexion (accept + poignée de main TLS)
+        self.requests_per_session = requests_per_session
+        self.think_time = think_time
+        self.connection_setup = connection_setup
+        self.max_keepalive_requests = self.config_data.get('KeepAlive', {}).get('max_requests', 100)
+
+    def read_config(self):
+        try:
+            with open(self.yaml_file_path, 'r') as file:
+                return yaml.safe_load(file)
+        except FileNotFoundError:
+            print(f"Fichier YAML introuvable à l'emplacement spécifié: {self.yaml_file_path}")
+            return None
+        except yaml.YAMLError as e:
+            print(f"Erreur de syntaxe YAML dans le fichier: {e}")
+            return None
+
+    def load_access_log(self, log_path):
+        # Retourne (débit d'arrivée en req/s, temps de service en s) ; le dernier champ
+        # de chaque ligne doit être le %D (microsecondes) du LogFormat.
+        timestamps = []
+        service_times = []
+        with open(log_path, 'r', errors='replace') as log:
+            for line in log:
+                match = self.LOG_TIMESTAMP.search(line)
+                fields = line.split()
+                if not match or not fields or not fields[-1].isdigit():
+                    continue
+                timestamps.append(datetime.strptime(match.group(1), '%d/%b/%Y:%H:%M:%S %z').timestamp())
+                service_times.append(int(fields[-1]) / 1e6)
+
+        if len(timestamps) < 2:
+            raise ValueError(f"Pas assez de lignes exploitables (avec %D) dans {log_path}")
+
+        duration = max(max(timestamps) - min(timestamps), 1.0)
+        return (len(timestamps) - 1) / duration, np.asarray(service_times)
+
+    def simulate(self, arrival_rate, service_mean, service_scv, workers, threads, keepalive):
+        # Évalue toute la grille ; retourne un dict de tableaux de même forme.
+        if self.mpm_module == 'prefork':
+            threads = [1]
+        mrw, tpc, kat = np.meshgrid(
+            np.asarray(workers, dtype=float),
+            np.asarray(threads, dtype=float),
+            np.asarray(keepalive, dtype=float),
+            indexing='ij'
+        )
+
+        # Apache arrondit MaxRequestWorkers au multiple inférieur de ThreadsPerChild
+        processes = np.maximum(np.floor(mrw / tpc), 1)
+        servers = processes * tpc
+
+        # Pauses exponentielles de moyenne T : la connexion survit à une pause si elle est plus
+        # courte que le timeout (probabilité 1 - exp(-k/T)). Un timeout plus long évite donc des
+        # ouvertures de connexion, mais garde plus longtemps des connexions inactives.
+        n, think = self.requests_per_session, self.think_time
+        broken = np.exp(-kat / think)
+        requests_per_connection = np.minimum(n / (1 + (n - 1) * broken), self.max_keepalive_requests)
+        # Inactivité par requête : E[min(pause, k)] pour les n - 1 pauses, puis k après la dernière
+        idle_per_request = ((n - 1) * think * (1 - broken) + kat) / n
+
+        # Avec worker/prefork, une connexion inactive garde son worker jusqu'au timeout ;
+        # event délègue les connexions inactives au thread listener.
+        hold = 0.0 if self.mpm_module == 'event' else idle_per_request
+        effective_service = service_mean + self.connection_setup / requests_per_connection + hold
+        offered_load = arrival_rate * effective_service
+        rho = offered_load / servers
+        stable = rho < 1
+
+        erlang_c = np.where(stable, self.erlang_c(servers, offered_load), 1.0)
+
+        # Queue de W_q en M/M/c, corrigée par le facteur d'Allen-Cunneen (1 + SCV) / 2
+        decay = np.where(stable, servers / effective_service - arrival_rate, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p99_wait = (1 + service_scv) / 2 * np.log(erlang_c / 0.01) / decay
+        p99_wait = np.where(erlang_c <= 0.01, 0.0, p99_wait)
+        p99_wait = np.where(stable, p99_wait, np.inf)
+
+        idle_connections = arrival_rate * idle_per_request
+        memory = processes * self.mem_process + servers * self.mem_thread + idle_connections * self.mem_connection
+
+        return {
+            'MaxRequestWorkers': servers.astype(int),
+            'ThreadsPerChild': tpc.astype(int),
+            'ServerLimit': processes.astype(int),
+            'KeepAliveTimeout': kat.astype(int),
+            'p99_wait': p99_wait,
+            'utilization': np.minimum(rho, 1.0),
+            'memory': memory,
+        }
+
+    def erlang_c(self, servers, offered_load):
+        # Probabilité d'attente d'Erlang C, par la récurrence d'Erlang B (stable numériquement).
+        servers = servers.astype(int)
+        erlang_b = np.ones_like(offered_load)
+        for n in range(1, int(servers.max()) + 1):
+            step = offered_load * erlang_b / (n + offered_load * erlang_b)
+            erlang_b = np.where(n <= servers, step, erlang_b)
+        rho = offered_load / servers
+        return erlang_b / (1 - rho * (1 - erlang_b))
+
+    def best_point(self, results, p99_target, max_utilization=0.8, keepalive_tolerance=0.01):
+        # 1. Le pool (MaxRequestWorkers, ThreadsPerChild) le moins gourmand en mémoire pour lequel
+        #    au moins un KeepAliveTimeout respecte la cible p99 et l'utilisation maximale.
+        # 2. Pour ce pool, le plus petit timeout qui obtient presque tout le gain d'utilisation
+        #    (à keepalive_tolerance près) : au-delà, le timeout ne fait qu'ajouter des connexions inactives.
+        feasible = (results['p99_wait'] <= p99_target) & (results['utilization'] <= max_utilization)
+        if not feasible.any():
+            print("Aucun point ne respecte les contraintes, sélection du p99 minimal.")
+            index = np.unravel_index(np.argmin(results['p99_wait']), results['p99_wait'].shape)
+            return {key: values[index].item() for key, values in results.items()}
+
+        pool_memory = results['ServerLimit'] * self.mem_process + results['MaxRequestWorkers'] * self.mem_thread
+        score = np.where(feasible, pool_memory, np.inf).min(axis=2)
+        workers, threads = np.unravel_index(np.argmin(score), score.shape)
+
+        utilization = np.where(feasible[workers, threads], results['utilization'][workers, threads], np.inf)
+        # La grille des timeouts est croissante : argmax renvoie le premier timeout suffisant
+        keepalive = np.argmax(utilization <= utilization.min() * (1 + keepalive_tolerance))
+        index = (workers, threads, keepalive)
+        return {key: values[index].item() for key, values in results.items()}
+
+    def export_yaml(self, point, output_path=None):
+        current = self.config_data.get('MPM_Modules', {})
+        threads = point['ThreadsPerChild']
+        workers = point['MaxRequestWorkers']
+        server_limit = max(point['ServerLimit'], 1)
+        # Section complète : elle doit pouvoir remplacer MPM_Modules telle quelle
+        # (merge_config ne remplace pas les valeurs du YAML principal).
+        min_spare = min(current.get('MinSpareThreads', threads), workers)
+        fragment = {
+            'MPM_Modules': {
+                **current,
+                'StartServers': min(current.get('StartServers', 1), server_limit),
+                'MinSpareThreads': min_spare,
+                # Apache exige MaxSpareThreads >= MinSpareThreads + ThreadsPerChild
+                'MaxSpareThreads': max(current.get('MaxSpareThreads', 0), min_spare + threads),
+                'ThreadLimit': max(threads, current.get('ThreadLimit', 0)),
+                'ThreadsPerChild': threads,
+                'MaxRequestWorkers': workers,
+                'ServerLimit': server_limit,
+            },
+            # Rendu par lol.py (keepalive_config.conf) ; les autres clés KeepAlive sont conservées
+            'KeepAlive': {
+                **self.config_data.get('KeepAlive', {}),
+                'timeout': point['KeepAliveTimeout'],
+            },
+        }
+        content = yaml.safe_dump(fragment, sort_keys=False)
+        if output_path:
+            with open(output_path, 'w') as file:
+                file.write(content)
+            print(f"Fragment YAML écrit dans {output_path}")
+        return content
+
+
+def parse_grid(value):
+    # '100:1000:100' (bornes incluses) ou '25,50,64'.
+    if ':' in value:
+        start, stop, step = (int(part) for part in value.split(':'))
+        return list(range(start, stop + 1, step))
+    return [int(part) for part in value.split(',')]
+
+
+def format_point(point):
+    p99 = '∞' if math.isinf(point['p99_wait']) else f"{point['p99_wait'] * 1000:.1f} ms"
+    return (f"MaxRequestWorkers={point['MaxRequestWorkers']} ThreadsPerChild={point['ThreadsPerChild']} "
+            f"KeepAliveTimeout={point['KeepAliveTimeout']} -> p99={p99} "
+            f"utilisation={point['utilization']:.0%} mémoire={point['memory']:.0f} Mo")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulateur de capacité hors ligne pour les paramètres MPM")
+    parser.add_argument('yaml', nargs='?', default='template.yaml')
+    parser.add_argument('--access-log', help="access log avec %%D en dernier champ")
+    parser.add_argument('--arrival-rate', type=float, help="requêtes par seconde")
+    parser.add_argument('--service-mean', type=float, help="temps de service moyen en ms")
+    parser.add_argument('--service-cv', type=float, default=1.0, help="coefficient de variation du temps de service")
+    parser.add_argument('--workers', default='100:2000:100')
+    parser.add_argument('--threads', default='16,25,32,64')
+    parser.add_argument('--keepalive', default='1,2,5,10,15')
+    parser.add_argument('--requests-per-session', type=float, default=10, help="requêtes par visite client")
+    parser.add_argument('--think-time', type=float, default=1.0, help="pause moyenne entre requêtes d'une visite, en s")
+    parser.add_argument('--connection-setup', type=float, default=2.0, help="coût serveur d'une nouvelle connexion, en ms")
+    parser.add_argument('--mem-process', type=float, default=30.0, help="Mo par processus enfant")
+    parser.add_argument('--mem-thread', type=float, default=2.0, help="Mo par thread")
+    parser.add_argument('--mem-connection', type=float, default=0.1, help="Mo par connexion keep-alive")
+    parser.add_argument('--p99-target', type=float, default=50.0, help="attente p99 cible en ms")
+    parser.add_argument('--max-utilization', type=float, default=0.8)
+    parser.add_argument('--export', help="chemin du fragment YAML à écrire")
+    args = parser.parse_args()
+
+    simulator = CapacitySimulator(args.yaml, args.mem_process, args.mem_thread, args.mem_connection,
+                                  args.requests_per_session, args.think_time, args.connection_setup / 1000)
+
+    arrival_rate = args.arrival_rate
+    service_mean = args.service_mean / 1000 if args.service_mean else None
+    service_scv = args.service_cv ** 2
+    if args.access_log:
+        log_rate, service_times = simulator.load_access_log(args.access_log)
+        arrival_rate = arrival_rate or log_rate
+        if service_mean is None:
+            service_mean = float(service_times.mean())
+            service_scv = float(service_times.var() / service_times.mean() ** 2)
+    if arrival_rate is None or service_mean is None:
+        parser.error("--arrival-rate et --service-mean, ou --access-log, sont requis")
+
+    print(f"MPM {simulator.mpm_module} : λ={arrival_rate:.1f} req/s, "
+          f"E[S]={service_mean * 1000:.1f} ms, SCV={service_scv:.2f}")
+
+    results = simulator.simulate(arrival_rate, service_mean, service_scv, parse_grid(args.workers),
+                                 parse_grid(args.threads), sorted(parse_grid(args.keepalive)))
+    for index in np.ndindex(results['memory'].shape):
+        print(format_point({key: values[index].item() for key, values in results.items()}))
+
+    best = simulator.best_point(results, args.p99_target / 1000, args.max_utilization)
+    print(f"\nMeilleur point : {format_point(best)}")
+    print(simulator.export_yaml(best, args.export))
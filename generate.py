@@ -6,6 +6,7 @@ class ApacheConfigGenerator:
     def __init__(self, yaml_file_path, config_directory='/etc/apache2/conf-available/'):
         self.yaml_file_path = yaml_file_path
         self.config_directory = config_directory
+        self.apache2_conf_path = '/etc/apache2/apache2.conf'
         self.config_data = self.read_config()
 
     def read_config(self):
@@ -126,7 +127,7 @@ expose_php {expose_php}
         self.include_config_in_main(file_path)
 
     def include_config_in_main(self, file_path):
-        apache2_conf_path = '/etc/apache2/apache2.conf'
+        apache2_conf_path = self.apache2_conf_path
         try:
             with open(apache2_conf_path, 'a') as apache2_conf:
                 apache2_conf.write(f"Include {file_path}\n")
@@ -1,17 +1,31 @@
 import yaml
 import subprocess
 import os
+import re
+import glob
 
 class ApacheConfigGenerator:
-    def __init__(self, yaml_file_path, config_directory='/etc/apache2/conf-available/'):
+    # Systèmes de fichiers locaux sur lesquels sendfile(2) et mmap(2) sont fiables
+    SENDFILE_SAFE_FILESYSTEMS = {'ext2', 'ext3', 'ext4', 'xfs', 'btrfs', 'tmpfs', 'f2fs', 'jfs', 'reiserfs'}
+
+    def __init__(self, yaml_file_path, config_directory='/etc/apache2/conf-available/', snapshots=None):
         self.yaml_file_path = yaml_file_path
         self.config_directory = config_directory
+        self.apache2_conf_path = '/etc/apache2/apache2.conf'
+        self.mounts_file = '/proc/mounts'
+        self.snapshots = snapshots
+        self.snapshot_version = None
+        self.mpm_switched = False
+        self.included_files = []
         self.config_data = self.read_config()
 
     def read_config(self):
         try:
             with open(self.yaml_file_path, 'r') as file:
-                return yaml.safe_load(file)
+                config_data = yaml.safe_load(file)
+            if config_data:
+                self.load_includes(config_data)
+            return config_data
         except FileNotFoundError:
             print(f"Fichier YAML introuvable à l'emplacement spécifié: {self.yaml_file_path}")
             return None
@@ -19,15 +33,72 @@ class ApacheConfigGenerator:
             print(f"Erreur de syntaxe YAML dans le fichier: {e}")
             return None
 
+    # Les fichiers d'inventaire listés sous Includes (motifs glob relatifs au YAML principal)
+    # sont fusionnés dans la configuration : les listes sont concaténées, et pour les autres
+    # valeurs celles du YAML principal restent prioritaires.
+    def include_patterns(self, config_data):
+        base_directory = os.path.dirname(os.path.abspath(self.yaml_file_path))
+        return [os.path.join(base_directory, pattern) for pattern in config_data.get('Includes', [])]
+
+    def load_includes(self, config_data):
+        self.included_files = []
+        for pattern in self.include_patterns(config_data):
+            for include_path in sorted(glob.glob(pattern)):
+                with open(include_path, 'r') as file:
+                    included_data = yaml.safe_load(file) or {}
+                self.included_files.append(include_path)
+                self.merge_config(config_data, included_data)
+
+    def merge_config(self, config_data, included_data):
+        for key, value in included_data.items():
+            if isinstance(value, dict) and isinstance(config_data.get(key), dict):
+                self.merge_config(config_data[key], value)
+            elif isinstance(value, list) and isinstance(config_data.get(key), list):
+                config_data[key].extend(item for item in value if item not in config_data[key])
+            elif key not in config_data:
+                config_data[key] = value
+
     def generate_apache_config(self):
         if self.config_data:
+            self.mpm_switched = False
+            self.begin_snapshot()
             self.create_config_directory()
             self.generate_general_config()
             self.generate_module_config()
+            self.generate_keepalive_config()
             self.generate_php_config()
             self.generate_security_config()
-            self.restart_apache()
-            self.include_general_config()
+            self.generate_static_config()
+            self.commit_snapshot()
+            if self.snapshots and not self.mpm_switched:
+                # La bascule atomique du lien current suffit : un rechargement graceful, pas de restart
+                self.reload_apache()
+            elif self.snapshots:
+                # Un changement de MPM exige un redémarrage, fait une seule fois après l'activation
+                self.restart_apache()
+            else:
+                self.restart_apache()
+                self.include_general_config()
+
+    # Avec un ConfigSnapshots, chaque génération écrit dans une nouvelle version immuable
+    # qui n'est activée (bascule du lien current) qu'une fois complète.
+    def begin_snapshot(self, copy_current=False):
+        if self.snapshots:
+            self.snapshot_version = self.snapshots.create_version(copy_current)
+            self.config_directory = self.snapshots.pending_path(self.snapshot_version)
+
+    def commit_snapshot(self):
+        if self.snapshots and self.snapshot_version:
+            self.snapshots.seal(self.snapshot_version)
+            self.snapshots.activate(self.snapshot_version)
+            self.snapshots.prune()
+            self.include_config_in_main(self.snapshots.include_pattern())
+            self.snapshot_version = None
+
+    def discard_snapshot(self):
+        if self.snapshots and self.snapshot_version:
+            self.snapshots.discard(self.snapshot_version)
+            self.snapshot_version = None
 
     def create_config_directory(self):
         try:
@@ -58,8 +129,22 @@ EnableSendfile {ENABLESENDFILE}
         print("Fichier general_config.conf généré")
 
     def generate_module_config(self):
-        modules = self.config_data.get('Modules', {})
-        
+        self.apply_module_states(self.config_data.get('Modules', {}))
+
+        mpm_module = self.config_data.get('Modules', {}).get('mpm')
+        if mpm_module:
+            active_mpm_module = self.get_active_mpm_module()
+            if active_mpm_module and active_mpm_module != mpm_module:
+                print(f"Désactivation du module MPM actuel ({active_mpm_module}) et activation de {mpm_module}")
+                self.switch_mpm_module(active_mpm_module, mpm_module)
+                self.mpm_switched = True
+        else:
+            print("Aucun module MPM spécifié dans le fichier YAML.")
+
+        self.install_required_modules()
+        self.generate_mpm_config()
+
+    def apply_module_states(self, modules):
         for module, value in modules.items():
             if module.startswith('mod_') and isinstance(value, bool):
                 if value:
@@ -75,17 +160,8 @@ EnableSendfile {ENABLESENDFILE}
                     else:
                         print(f"La fonction de désactivation pour le module {module} n'est pas implémentée.")
 
+    def generate_mpm_config(self):
         mpm_module = self.config_data.get('Modules', {}).get('mpm')
-        if mpm_module:
-            active_mpm_module = self.get_active_mpm_module()
-            if active_mpm_module and active_mpm_module != mpm_module:
-                print(f"Désactivation du module MPM actuel ({active_mpm_module}) et activation de {mpm_module}")
-                self.deactivate_activate_mpm_module(active_mpm_module, mpm_module)
-        else:
-            print("Aucun module MPM spécifié dans le fichier YAML.")
-
-        self.install_required_modules()
-
         mpm_config = """
 <IfModule {mpm_module}_module>
     StartServers {StartServers}
@@ -105,6 +181,26 @@ EnableSendfile {ENABLESENDFILE}
         self.write_config_to_file(mpm_config, 'mpm_config.conf')
         print("Fichier mpm_config.conf généré")
 
+    def generate_keepalive_config(self):
+        keepalive = self.config_data.get('KeepAlive', {})
+        enabled = keepalive.get('enabled', True)
+        # YAML 1.1 lit On/Off comme des booléens
+        if isinstance(enabled, bool):
+            enabled = 'On' if enabled else 'Off'
+
+        keepalive_config = """
+KeepAlive {enabled}
+KeepAliveTimeout {timeout}
+MaxKeepAliveRequests {max_requests}
+""".format(
+    enabled=enabled,
+    timeout=keepalive.get('timeout', 5),
+    max_requests=keepalive.get('max_requests', 100)
+)
+
+        self.write_config_to_file(keepalive_config, 'keepalive_config.conf')
+        print("Fichier keepalive_config.conf généré")
+
     def generate_php_config(self):
         php_config_template = """
 expose_php {expose_php}
@@ -138,22 +234,140 @@ expose_php {expose_php}
         self.write_config_to_file(security_config, 'security_config.conf')
         print("Fichier security_config.conf généré")
 
+    def generate_static_config(self):
+        static = self.config_data.get('Static')
+        if not static:
+            print("Aucune section Static dans le fichier YAML.")
+            return
+
+        blocks = []
+
+        # sendfile/mmap uniquement sur les systèmes de fichiers locaux, jamais sur NFS/SMB/FUSE
+        mounts = self.read_mounts()
+        for document_root in static.get('DocumentRoots', []):
+            fstype = self.detect_filesystem(document_root, mounts)
+            safe = 'On' if fstype in self.SENDFILE_SAFE_FILESYSTEMS else 'Off'
+            blocks.append("""
+# {document_root} ({fstype})
+<Directory "{document_root}">
+    EnableMMAP {safe}
+    EnableSendfile {safe}
+</Directory>
+""".format(document_root=document_root, fstype=fstype or 'inconnu', safe=safe))
+
+        blocks.append("""
+FileETag {file_etag}
+
+<IfModule mod_expires.c>
+    ExpiresActive On
+</IfModule>
+""".format(file_etag=static.get('FileETag', 'MTime Size')))
+
+        for asset_type, rules in static.get('Assets', {}).items():
+            # Sans extension, le motif "\.()$" correspondrait à tout nom finissant par un point
+            if not rules.get('extensions'):
+                print(f"Type d'asset {asset_type} ignoré : aucune extension.")
+                continue
+            extensions = "\\.({})$".format("|".join(rules['extensions']))
+            max_age = int(rules.get('max_age', 0))
+
+            if not rules.get('immutable', False):
+                blocks.append(self.render_cache_rule(asset_type, extensions, max_age))
+                continue
+
+            # immutable uniquement pour les noms empreintés (style.3f9a1c2e.css) : un /style.css
+            # non versionné resterait sinon en cache un an après un déploiement
+            blocks.append(self.render_cache_rule(
+                f"{asset_type} (non versionnés)", extensions, int(rules.get('unversioned_max_age', 0))
+            ))
+            fingerprint = rules.get('fingerprint', '\\.[0-9a-f]{8,}')
+            blocks.append(self.render_cache_rule(
+                f"{asset_type} (empreintés)", fingerprint + extensions, max_age, immutable=True
+            ))
+
+        self.write_config_to_file("".join(blocks), 'static_config.conf')
+        print("Fichier static_config.conf généré")
+
+    def render_cache_rule(self, comment, pattern, max_age, immutable=False):
+        if max_age > 0:
+            cache_control = f"public, max-age={max_age}"
+            if immutable:
+                cache_control += ", immutable"
+        else:
+            cache_control = "no-cache"
+
+        # Les FilesMatch s'appliquent dans l'ordre : une règle plus loin l'emporte sur les précédentes
+        return """
+# {comment}
+<FilesMatch "{pattern}">
+    <IfModule mod_expires.c>
+        ExpiresDefault "access plus {max_age} seconds"
+    </IfModule>
+    <IfModule mod_headers.c>
+        Header set Cache-Control "{cache_control}"
+    </IfModule>
+</FilesMatch>
+""".format(comment=comment, pattern=pattern, max_age=max_age, cache_control=cache_control)
+
+    def read_mounts(self):
+        # Table (point de montage, type), triée du plus long au plus court : le premier
+        # point de montage qui contient un chemin est donc le plus spécifique
+        mounts = []
+        try:
+            with open(self.mounts_file, 'r') as file:
+                for line in file:
+                    fields = line.split()
+                    if len(fields) < 3:
+                        continue
+                    # /proc/mounts encode les espaces et tabulations en octal (\040, \011)
+                    mount_point = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[1])
+                    mounts.append((mount_point, fields[2]))
+        except Exception as e:
+            print(f"Erreur lors de la lecture de {self.mounts_file} : {e}")
+        # À longueur égale, la dernière entrée (montage le plus récent) l'emporte
+        mounts.reverse()
+        mounts.sort(key=lambda mount: len(mount[0]), reverse=True)
+        return mounts
+
+    def detect_filesystem(self, path, mounts):
+        try:
+            # Un chemin inexistant retomberait sur le point de montage parent (souvent /)
+            if not os.path.exists(path):
+                return None
+            real_path = os.path.realpath(path)
+            for mount_point, fstype in mounts:
+                if real_path == mount_point or real_path.startswith(mount_point.rstrip('/') + '/'):
+                    return fstype
+            return None
+        except Exception as e:
+            print(f"Erreur lors de la détection du système de fichiers de {path} : {e}")
+            return None
+
     def write_config_to_file(self, config_content, file_name):
         file_path = os.path.join(self.config_directory, file_name)
         with open(file_path, 'w') as file:
             file.write(config_content)
-        self.include_config_in_main(file_path)
+        # En mode versions, apache2.conf inclut une seule fois current/*.conf
+        if not self.snapshots:
+            self.include_config_in_main(file_path)
 
     def include_config_in_main(self, file_path):
-        apache2_conf_path = '/etc/apache2/apache2.conf'
+        apache2_conf_path = self.apache2_conf_path
+        include_line = f"Include {file_path}\n"
         try:
+            # Ne pas dupliquer la directive à chaque régénération
+            with open(apache2_conf_path, 'r') as apache2_conf:
+                if include_line in apache2_conf.readlines():
+                    return
             with open(apache2_conf_path, 'a') as apache2_conf:
-                apache2_conf.write(f"Include {file_path}\n")
+                apache2_conf.write(include_line)
             print(f"Inclusion de {file_path} dans {apache2_conf_path}")
         except Exception as e:
             print(f"Erreur lors de l'inclusion dans {apache2_conf_path}: {e}")
 
     def include_general_config(self):
+        if self.snapshots:
+            return
         self.include_config_in_main(os.path.join(self.config_directory, 'general_config.conf'))
 
     def restart_apache(self):
@@ -163,6 +377,13 @@ expose_php {expose_php}
         except Exception as e:
             print(f"Erreur lors du redémarrage d'Apache2 : {e}")
 
+    def reload_apache(self):
+        try:
+            subprocess.run(['sudo', 'systemctl', 'reload', 'apache2'])
+            print("Apache2 rechargé (graceful).")
+        except Exception as e:
+            print(f"Erreur lors du rechargement d'Apache2 : {e}")
+
     def get_active_mpm_module(self):
         try:
             result = subprocess.run(['apache2ctl', '-V'], capture_output=True, text=True)
@@ -173,10 +394,15 @@ expose_php {expose_php}
             return None
 
     def deactivate_activate_mpm_module(self, active_mpm_module, new_mpm_module):
+        self.switch_mpm_module(active_mpm_module, new_mpm_module)
+        self.restart_apache()
+
+    # Bascule a2dismod/a2enmod seule : le redémarrage, indispensable pour changer de MPM,
+    # est laissé à l'appelant une fois la nouvelle configuration en place.
+    def switch_mpm_module(self, active_mpm_module, new_mpm_module):
         try:
             subprocess.run(['sudo', 'a2dismod', f'mpm_{active_mpm_module}'])
             subprocess.run(['sudo', 'a2enmod', f'mpm_{new_mpm_module}'])
-            subprocess.run(['sudo', 'systemctl', 'restart', 'apache2'])
         except Exception as e:
             print(f"Erreur lors de la désactivation/activation des modules MPM : {e}")
 
@@ -205,6 +431,18 @@ expose_php {expose_php}
     def deactivate_mod_deflate(self):
         self.deactivate_module('deflate')
 
+    def activate_mod_expires(self):
+        self.activate_module('expires')
+
+    def deactivate_mod_expires(self):
+        self.deactivate_module('expires')
+
+    def activate_mod_headers(self):
+        self.activate_module('headers')
+
+    def deactivate_mod_headers(self):
+        self.deactivate_module('headers')
+
     # Fonctions d'activation et de désactivation des modules génériques
     def activate_module(self, module):
         try:
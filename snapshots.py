@@ -0,0 +1,222 @@
+import argparse
+import contextlib
+import difflib
+import fcntl
+import os
+import shutil
+import stat
+import subprocess
+import time
+
+from lol import ApacheConfigGenerator
+
+
+class ConfigSnapshots:
+    # Chaque génération est stockée dans versions/<numéro>-<horodatage>/ puis rendue immuable ;
+    # Apache inclut current/*.conf, et current est un lien symbolique remplacé atomiquement.
+    def __init__(self, base_directory='/etc/apache2/conf-snapshots/', retention=10):
+        self.base_directory = base_directory
+        self.versions_directory = os.path.join(base_directory, 'versions')
+        self.current_link = os.path.join(base_directory, 'current')
+        self.retention = retention
+
+    def include_pattern(self):
+        return os.path.join(self.current_link, '*.conf')
+
+    def list_versions(self):
+        try:
+            return sorted(name for name in os.listdir(self.versions_directory) if not name.startswith('.'))
+        except FileNotFoundError:
+            return []
+
+    def current_version(self):
+        try:
+            return os.path.basename(os.readlink(self.current_link))
+        except OSError:
+            return None
+
+    def resolve_version(self, version):
+        # Accepte le nom complet ou seulement le numéro ("12" ou "0012")
+        versions = self.list_versions()
+        if version in versions:
+            return version
+        matches = [name for name in versions if version.isdigit() and int(name.split('-')[0]) == int(version)]
+        if not matches:
+            raise ValueError(f"Version introuvable : {version}")
+        return matches[0]
+
+    def version_path(self, version):
+        return os.path.join(self.versions_directory, version)
+
+    # Une version en cours de génération vit sous un nom caché, ignoré par list_versions,
+    # et n'est renommée dans versions/ qu'au moment d'être scellée.
+    def pending_path(self, version):
+        return os.path.join(self.versions_directory, f'.pending-{os.getpid()}-{version}')
+
+    def remove_stale_pending(self):
+        for name in os.listdir(self.versions_directory):
+            if not name.startswith('.pending-'):
+                continue
+            pid = int(name.split('-')[1])
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                # Génération interrompue : le processus qui l'écrivait n'existe plus
+                self.remove_directory(os.path.join(self.versions_directory, name))
+                print(f"Version inachevée {name} supprimée")
+            except PermissionError:
+                pass
+
+    @contextlib.contextmanager
+    def lock(self):
+        # Verrou exclusif partagé par tous les processus (watch.py, snapshots.py generate)
+        # qui numérotent ou scellent des versions dans ce répertoire
+        os.makedirs(self.versions_directory, exist_ok=True)
+        with open(os.path.join(self.base_directory, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def next_number(self):
+        # Les versions en cours d'écriture par d'autres processus réservent aussi leur numéro
+        numbers = [int(name.split('-')[0]) for name in self.list_versions()]
+        numbers += [int(name.split('-')[2]) for name in os.listdir(self.versions_directory)
+                    if name.startswith('.pending-')]
+        return max(numbers, default=0) + 1
+
+    def create_version(self, copy_current=False):
+        with self.lock():
+            version = f"{self.next_number():04d}-{time.strftime('%Y%m%dT%H%M%S')}"
+            version_path = self.pending_path(version)
+            os.makedirs(version_path)
+        current = self.current_version()
+        if copy_current and current:
+            # Régénération partielle : on repart des fichiers de la version active
+            shutil.copytree(self.version_path(current), version_path, dirs_exist_ok=True)
+            os.chmod(version_path, 0o755)
+            for file_name in os.listdir(version_path):
+                os.chmod(os.path.join(version_path, file_name), 0o644)
+        print(f"Version {version} créée")
+        return version
+
+    def seal(self, version):
+        pending_path = self.pending_path(version)
+        for file_name in os.listdir(pending_path):
+            os.chmod(os.path.join(pending_path, file_name), 0o444)
+        os.chmod(pending_path, 0o555)
+        with self.lock():
+            os.rename(pending_path, self.version_path(version))
+
+    def discard(self, version):
+        # Version jamais activée (aucun changement à appliquer, ou génération en échec)
+        pending_path = self.pending_path(version)
+        if os.path.exists(pending_path):
+            self.remove_directory(pending_path)
+        else:
+            self.remove_directory(self.version_path(version))
+
+    def remove_directory(self, path):
+        os.chmod(path, stat.S_IRWXU)
+        shutil.rmtree(path)
+
+    def activate(self, version):
+        version = self.resolve_version(version)
+        temporary_link = os.path.join(self.base_directory, f'.current-{os.getpid()}')
+        if os.path.lexists(temporary_link):
+            os.remove(temporary_link)
+        os.symlink(os.path.join('versions', version), temporary_link)
+        # rename(2) remplace le lien en une seule opération : Apache ne voit jamais d'état intermédiaire
+        os.replace(temporary_link, self.current_link)
+        print(f"Version {version} activée")
+        return version
+
+    def rollback(self):
+        versions = self.list_versions()
+        current = self.current_version()
+        if current not in versions or versions.index(current) == 0:
+            raise ValueError("Aucune version précédente vers laquelle revenir")
+        return self.activate(versions[versions.index(current) - 1])
+
+    def prune(self, retention=None):
+        retention = self.retention if retention is None else retention
+        self.remove_stale_pending()
+        current = self.current_version()
+        versions = self.list_versions()
+        for version in versions[:max(len(versions) - retention, 0)]:
+            if version == current:
+                continue
+            self.discard(version)
+            print(f"Version {version} supprimée")
+
+    def diff(self, old_version, new_version=None):
+        old_version = self.resolve_version(old_version)
+        new_version = new_version or self.current_version()
+        if new_version is None:
+            raise ValueError("Aucune version active, préciser la seconde version à comparer")
+        new_version = self.resolve_version(new_version)
+        old_path, new_path = self.version_path(old_version), self.version_path(new_version)
+        lines = []
+        for file_name in sorted(set(os.listdir(old_path)) | set(os.listdir(new_path))):
+            lines.extend(difflib.unified_diff(
+                self.read_lines(os.path.join(old_path, file_name)),
+                self.read_lines(os.path.join(new_path, file_name)),
+                fromfile=f"{old_version}/{file_name}",
+                tofile=f"{new_version}/{file_name}"
+            ))
+        return "".join(lines)
+
+    def read_lines(self, file_path):
+        try:
+            with open(file_path, 'r') as file:
+                return file.readlines()
+        except FileNotFoundError:
+            return []
+
+    def reload_apache(self):
+        try:
+            subprocess.run(['sudo', 'systemctl', 'reload', 'apache2'])
+            print("Apache2 rechargé (graceful).")
+        except Exception as e:
+            print(f"Erreur lors du rechargement d'Apache2 : {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Versions immuables de la configuration Apache générée")
+    parser.add_argument('--base-directory', default='/etc/apache2/conf-snapshots/')
+    parser.add_argument('--retention', type=int, default=10, help="nombre de versions conservées")
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate_parser = commands.add_parser('generate', help="générer et activer une nouvelle version")
+    generate_parser.add_argument('yaml', nargs='?', default='template.yaml')
+    commands.add_parser('list', help="lister les versions")
+    activate_parser = commands.add_parser('activate', help="activer une version")
+    activate_parser.add_argument('version')
+    commands.add_parser('rollback', help="revenir à la version précédente")
+    commands.add_parser('prune', help="appliquer la politique de rétention")
+    diff_parser = commands.add_parser('diff', help="différences entre deux versions")
+    diff_parser.add_argument('old_version')
+    diff_parser.add_argument('new_version', nargs='?', help="par défaut, la version active")
+    args = parser.parse_args()
+
+    snapshots = ConfigSnapshots(args.base_directory, args.retention)
+    try:
+        if args.command == 'generate':
+            ApacheConfigGenerator(args.yaml, snapshots=snapshots).generate_apache_config()
+        elif args.command == 'list':
+            current = snapshots.current_version()
+            for version in snapshots.list_versions():
+                print(f"{'*' if version == current else ' '} {version}")
+        elif args.command == 'activate':
+            snapshots.activate(args.version)
+            snapshots.reload_apache()
+        elif args.command == 'rollback':
+            snapshots.rollback()
+            snapshots.reload_apache()
+        elif args.command == 'prune':
+            snapshots.prune()
+        elif args.command == 'diff':
+            print(snapshots.diff(args.old_version, args.new_version), end='')
+    except ValueError as e:
+        print(f"Erreur : {e}")
+        raise SystemExit(1)
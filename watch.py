@@ -0,0 +1,241 @@
+import argparse
+import ctypes
+import ctypes.util
+import fnmatch
+import glob
+import os
+import select
+import struct
+import time
+
+from lol import ApacheConfigGenerator
+from snapshots import ConfigSnapshots
+
+
+class InotifyBackend:
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 a échoué")
+        self.directories = {}
+
+    def watch(self, paths):
+        # On surveille les répertoires parents : les éditeurs remplacent souvent le fichier par un rename
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        directories = {os.path.dirname(path) for path in paths if not glob.has_magic(os.path.dirname(path))}
+        for directory in directories - set(self.directories.values()):
+            wd = self.libc.inotify_add_watch(self.fd, directory.encode(), mask)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch a échoué pour {directory}")
+            self.directories[wd] = directory
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        buffer = os.read(self.fd, 65536)
+        changed = []
+        offset = 0
+        while offset < len(buffer):
+            wd, _, _, name_length = self.EVENT_HEADER.unpack_from(buffer, offset)
+            offset += self.EVENT_HEADER.size
+            name = buffer[offset:offset + name_length].rstrip(b'\0').decode()
+            offset += name_length
+            if wd in self.directories and name:
+                changed.append(os.path.join(self.directories[wd], name))
+        return changed
+
+
+class PollingBackend:
+    def __init__(self, poll_interval=0.5):
+        self.poll_interval = poll_interval
+        self.paths = set()
+        self.signatures = {}
+
+    def signature(self, path):
+        # Un motif glob a pour signature celle de l'ensemble des fichiers qu'il désigne
+        signature = []
+        for match in sorted(glob.glob(path)):
+            try:
+                stat = os.stat(match)
+                signature.append((match, stat.st_mtime_ns, stat.st_size, stat.st_ino))
+            except FileNotFoundError:
+                pass
+        return signature
+
+    def watch(self, paths):
+        for path in set(paths) - self.paths:
+            self.signatures[path] = self.signature(path)
+        self.paths |= set(paths)
+
+    def wait(self, timeout):
+        time.sleep(self.poll_interval if timeout is None else min(timeout, self.poll_interval))
+        changed = []
+        for path in self.paths:
+            signature = self.signature(path)
+            if signature != self.signatures[path]:
+                self.signatures[path] = signature
+                changed.append(path)
+        return changed
+
+
+class ConfigWatcher:
+    # Clés YAML de premier niveau -> méthode qui régénère la section correspondante
+    SECTIONS = {
+        'generate_general_config': ['Options', 'HostnameLookups', 'AllowOverride', 'EnableMMAP', 'EnableSendfile'],
+        'generate_keepalive_config': ['KeepAlive'],
+        'generate_php_config': ['PHP'],
+        'generate_security_config': ['Security', 'Rules'],
+        'generate_static_config': ['Static'],
+    }
+
+    def __init__(self, generator, debounce=0.2, poll_interval=0.5, force_polling=False):
+        self.generator = generator
+        self.debounce = debounce
+        self.backend = None
+        if not force_polling:
+            try:
+                self.backend = InotifyBackend()
+            except (OSError, AttributeError) as e:
+                print(f"inotify indisponible ({e}), passage en mode polling")
+        if self.backend is None:
+            self.backend = PollingBackend(poll_interval)
+        self.update_watches()
+
+    def watched_paths(self):
+        return [os.path.abspath(self.generator.yaml_file_path)] + self.generator.included_files
+
+    def update_watches(self):
+        self.patterns = self.generator.include_patterns(self.generator.config_data or {})
+        # Les motifs Includes sont surveillés aussi : ils peuvent désigner des fichiers pas encore créés
+        self.backend.watch(self.watched_paths() + self.patterns)
+
+    def is_relevant(self, path):
+        if path in self.watched_paths() or path in self.patterns:
+            return True
+        return any(fnmatch.fnmatch(path, pattern) for pattern in self.patterns)
+
+    def run(self):
+        print(f"Surveillance de {', '.join(self.watched_paths())} ({type(self.backend).__name__})")
+        last_event = None
+        while True:
+            timeout = None if last_event is None else max(0.0, last_event + self.debounce - time.monotonic())
+            if any(self.is_relevant(path) for path in self.backend.wait(timeout)):
+                last_event = time.monotonic()
+            elif last_event is not None and time.monotonic() - last_event >= self.debounce:
+                last_event = None
+                self.apply_changes()
+
+    def apply_changes(self):
+        started = time.monotonic()
+        previous = self.generator.config_data or {}
+        previous_modules = previous.get('Modules', {})
+        current = self.generator.read_config()
+        if not current:
+            print("Configuration invalide, la configuration en service est conservée.")
+            self.generator.config_data = previous
+            return
+
+        changed_keys = {key for key in set(previous) | set(current) if previous.get(key) != current.get(key)}
+        self.generator.config_data = current
+        self.update_watches()
+        previous_directory = self.generator.config_directory
+        modules = current.get('Modules', {})
+        modules_applied = False
+        try:
+            # Toutes les sections sont rendues avant de toucher aux modules : une section en échec
+            # n'a alors rien modifié sur le système
+            regenerated = self.render_changes(changed_keys)
+            self.generator.mpm_switched = False
+            if 'Modules' in changed_keys:
+                modules_applied = True
+                self.apply_module_changes(previous_modules, modules)
+            if 'Required_Modules' in changed_keys:
+                self.generator.install_required_modules()
+            # Un seul rechargement par lot de modifications, après l'activation de la nouvelle version :
+            # graceful en général, redémarrage seulement si le MPM a changé
+            if not regenerated:
+                self.generator.discard_snapshot()
+                return
+            self.generator.commit_snapshot()
+            if self.generator.mpm_switched:
+                self.generator.restart_apache()
+            else:
+                self.generator.reload_apache()
+        except Exception as e:
+            # Même repli que pour un YAML invalide : la configuration en service est conservée
+            print(f"Erreur lors de la régénération : {e!r}, la configuration en service est conservée.")
+            if modules_applied:
+                self.revert_module_changes(modules, previous_modules)
+            self.generator.discard_snapshot()
+            self.generator.config_directory = previous_directory
+            self.generator.config_data = previous
+            return
+        print(f"Changements appliqués ({', '.join(sorted(changed_keys))}) en {time.monotonic() - started:.3f}s")
+
+    def render_changes(self, changed_keys):
+        # Écrit uniquement des fichiers dans la nouvelle version ; les modules sont appliqués ensuite
+        regenerated = 'Required_Modules' in changed_keys
+        self.generator.begin_snapshot(copy_current=True)
+        if changed_keys & {'Modules', 'MPM_Modules'}:
+            self.generator.generate_mpm_config()
+            regenerated = True
+        for method, keys in self.SECTIONS.items():
+            if changed_keys.intersection(keys):
+                getattr(self.generator, method)()
+                regenerated = True
+        return regenerated
+
+    def apply_module_changes(self, previous_modules, modules):
+        # L'état des modules est gardé en mémoire : seuls ceux qui ont changé sont (dés)activés
+        changed = {module: value for module, value in modules.items()
+                   if module != 'mpm' and previous_modules.get(module) != value}
+        self.generator.apply_module_states(changed)
+
+        previous_mpm, mpm_module = previous_modules.get('mpm'), modules.get('mpm')
+        if previous_mpm and mpm_module and previous_mpm != mpm_module:
+            print(f"Désactivation du module MPM actuel ({previous_mpm}) et activation de {mpm_module}")
+            self.generator.switch_mpm_module(previous_mpm, mpm_module)
+            self.generator.mpm_switched = True
+
+    def revert_module_changes(self, modules, previous_modules):
+        # Remet les modules (dés)activés pendant le lot dans l'état de la configuration conservée ;
+        # un module absent de celle-ci retrouve l'état inverse de celui qui vient d'être appliqué
+        restored = {module: not value for module, value in modules.items()
+                    if module not in previous_modules and isinstance(value, bool)}
+        restored.update(previous_modules)
+        try:
+            self.apply_module_changes(modules, restored)
+        except Exception as e:
+            print(f"Erreur lors de la restauration des modules : {e!r}")
+        self.generator.mpm_switched = False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Régénère la configuration Apache à chaque modification du YAML")
+    parser.add_argument('yaml', nargs='?', default='template.yaml')
+    parser.add_argument('--config-directory', default='/etc/apache2/conf-available/')
+    parser.add_argument('--debounce', type=float, default=0.2, help="secondes de calme avant régénération")
+    parser.add_argument('--poll', action='store_true', help="forcer le polling au lieu d'inotify")
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--snapshots', help="répertoire des versions (voir snapshots.py)")
+    parser.add_argument('--skip-initial', action='store_true', help="ne pas générer la configuration au démarrage")
+    args = parser.parse_args()
+
+    snapshots = ConfigSnapshots(args.snapshots) if args.snapshots else None
+    generator = ApacheConfigGenerator(args.yaml, args.config_directory, snapshots)
+    if not args.skip_initial:
+        generator.generate_apache_config()
+    watcher = ConfigWatcher(generator, args.debounce, args.poll_interval, args.poll)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print("Arrêt de la surveillance.")